@@ -1,93 +1,204 @@
 import boto3
 import json
+import math
+import msgspec
+import orjson
 import os
+import socket
+import socketserver
 import sys
+import numpy as np
+from botocore.config import Config
+from botocore.exceptions import ClientError
 from dotenv import load_dotenv
 from pymilvus import connections, Collection
-from sentence_transformers import SentenceTransformer
+from cache import QueryCache
+from documents import Doc, RetrievalResponse, RetrievalResult
+from embedding import encode
+import text_store
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential_jitter
 
 load_dotenv()
 
-client = boto3.client("bedrock-runtime", region_name="us-east-1")
+bedrock_config = Config(
+    region_name="us-east-1",
+    max_pool_connections=50,
+    retries={"max_attempts": 3, "mode": "adaptive"},
+    tcp_keepalive=True
+)
+client = boto3.client("bedrock-runtime", config=bedrock_config)
 model_id = "qwen.qwen3-coder-30b-a3b-v1:0"
 
 MILVUS_HOST = "localhost"
 MILVUS_PORT = "19530"
 COLLECTION_NAME = "nimonik_rag"
-
-embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+SEARCH_EF = 64
+SOCKET_PATH = os.getenv("MILVUS_RAG_SOCKET", "/tmp/rag-milvus.sock")
+SOCKET_TIMEOUT = float(os.getenv("MILVUS_RAG_SOCKET_TIMEOUT", "30"))
 
 class MilvusRAG:
     def __init__(self):
         self.collection = None
         self.connected = False
+        self._loaded = False
+        self.index_type = "HNSW"
+        self.nlist = None
     
     def connect(self):
         """Connect to Milvus and load collection."""
+        if self.connected:
+            return
         try:
             connections.connect("default", host=MILVUS_HOST, port=MILVUS_PORT)
             self.collection = Collection(COLLECTION_NAME)
-            self.collection.load()
+            self.read_index_params()
+            if not self._loaded:
+                self.collection.load()
+                self._loaded = True
             self.connected = True
             print(f"Connected to Milvus collection: {COLLECTION_NAME}")
         except Exception as e:
             print(f"Failed to connect to Milvus: {e}")
             raise
     
+    def read_index_params(self):
+        """Record the collection's index type and nlist so searches send matching parameters."""
+        index_params = self.collection.index().params
+        build_params = index_params.get("params", {})
+        if isinstance(build_params, str):
+            build_params = json.loads(build_params)
+        self.index_type = index_params.get("index_type", "HNSW")
+        self.nlist = build_params.get("nlist")
+    
+    def search_params(self, top_k):
+        """Search parameters for the collection's index: ef for HNSW, nprobe = sqrt(nlist) for IVF"""
+        if self.index_type == "HNSW":
+            params = {"ef": max(SEARCH_EF, top_k)}
+        else:
+            params = {"nprobe": max(1, int(round(math.sqrt(int(self.nlist or 1024)))))}
+        return {"metric_type": "IP", "params": params}
+    
     def disconnect(self):
         """Disconnect from Milvus."""
         if self.connected:
             connections.disconnect("default")
             self.connected = False
+            self._loaded = False
             print("Disconnected from Milvus")
     
-    def get_embedding(self, text):
-        """Generate embedding for the given text"""
-        return embedding_model.encode(text).tolist()
+    def warm_up(self):
+        """Run one search with a random vector so the index is paged into memory."""
+        dim = len(self.get_embedding("warm up"))
+        self.retrieve_relevant_docs("", top_k=1, query_embedding=np.random.rand(dim).astype(np.float32))
+    
+    def get_embedding(self, texts):
+        """Generate normalized float32 embeddings for a text or a list of texts"""
+        if isinstance(texts, str):
+            return encode([texts])[0]
+        return encode(texts)
     
-    def retrieve_relevant_docs(self, query, top_k=3):
+    def retrieve_relevant_docs(self, query, top_k=3, query_embedding=None):
         """Retrieve relevant documents from Milvus based on the query"""
         if not self.connected:
             raise ValueError("Not connected to Milvus")
         
-        query_embedding = self.get_embedding(query)
+        if query_embedding is None:
+            query_embedding = self.get_embedding(query)
         
-        search_params = {
-            "metric_type": "COSINE",
-            "params": {"nprobe": 10}
-        }
+        search_params = self.search_params(top_k)
         
         results = self.collection.search(
-            data=[query_embedding],
+            data=[np.asarray(query_embedding, dtype=np.float16)],
             anns_field="embedding",
             param=search_params,
             limit=top_k,
-            output_fields=["text", "title", "source", "chunk_index", "total_chunks"]
+            output_fields=["orig_id", "text_key", "title", "source", "chunk_index", "total_chunks"]
         )
         
-        relevant_docs = []
-        for hit in results[0]:
-            relevant_docs.append({
-                'content': hit.entity.get('text', ''),
-                'title': hit.entity.get('title', ''),
-                'source': hit.entity.get('source', ''),
-                'chunk_index': hit.entity.get('chunk_index', 0),
-                'total_chunks': hit.entity.get('total_chunks', 1),
-                'score': hit.score
-            })
+        texts = text_store.get_texts([hit.entity.get('text_key') for hit in results[0]])
         
-        return relevant_docs
+        return RetrievalResult.from_docs([
+            Doc(
+                id=hit.entity.get('orig_id'),
+                content=text,
+                score=hit.score,
+                title=hit.entity.get('title') or '',
+                source=hit.entity.get('source') or '',
+                chunk_index=hit.entity.get('chunk_index') or 0,
+                total_chunks=hit.entity.get('total_chunks') or 1
+            )
+            for hit, text in zip(results[0], texts)
+        ])
 
 milvus_rag = MilvusRAG()
 
-def create_rag_prompt(user_query, relevant_docs):
+class RetrievalRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        """Read a {prompt, top_k} JSON request and reply with the query embedding and documents."""
+        request = json.loads(self.rfile.readline())
+        query_embedding = milvus_rag.get_embedding(request['prompt'])
+        retrieved = milvus_rag.retrieve_relevant_docs(
+            request['prompt'],
+            top_k=request.get('top_k', 3),
+            query_embedding=query_embedding
+        )
+        response = RetrievalResponse(embedding=query_embedding.tolist(), docs=retrieved.docs)
+        self.wfile.write(msgspec.json.encode(response) + b"\n")
+
+def serve():
+    """Keep the Milvus collection loaded and answer retrieval requests over a Unix socket."""
+    milvus_rag.connect()
+    milvus_rag.warm_up()
+
+    if os.path.exists(SOCKET_PATH):
+        os.remove(SOCKET_PATH)
+
+    with socketserver.UnixStreamServer(SOCKET_PATH, RetrievalRequestHandler) as server:
+        print(f"Retrieval server listening on {SOCKET_PATH}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print("\nShutting down retrieval server")
+        finally:
+            os.remove(SOCKET_PATH)
+            milvus_rag.disconnect()
+
+def retrieve_remote(prompt, top_k=3):
+    """Retrieve documents through the retrieval server, or return None if it isn't running or fails to reply"""
+    if not hasattr(socket, "AF_UNIX"):
+        return None
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(SOCKET_TIMEOUT)
+            sock.connect(SOCKET_PATH)
+            sock.sendall(json.dumps({'prompt': prompt, 'top_k': top_k}).encode('utf-8') + b"\n")
+            with sock.makefile('rb') as f:
+                response = msgspec.json.decode(f.readline(), type=RetrievalResponse)
+    except (OSError, msgspec.DecodeError):
+        return None
+
+    retrieved = RetrievalResult.from_docs(response.docs)
+    return np.asarray(response.embedding, dtype=np.float32), retrieved
+
+def search_knowledge_base(prompt, top_k=3):
+    """Return the query embedding and relevant documents, preferring the retrieval server"""
+    remote = retrieve_remote(prompt, top_k=top_k)
+    if remote is not None:
+        return remote
+
+    print("\nConnecting to Milvus...")
+    milvus_rag.connect()
+    query_embedding = milvus_rag.get_embedding(prompt)
+    retrieved = milvus_rag.retrieve_relevant_docs(prompt, top_k=top_k, query_embedding=query_embedding)
+    return query_embedding, retrieved
+
+def create_rag_prompt(user_query, retrieved):
     """Create a prompt that includes retrieved context"""
-    context = "\n\n".join([doc['content'] for doc in relevant_docs])
-    
     prompt = f"""Based on the following context, please answer the user's question:
 
 Context:
-{context}
+{retrieved.context_blob}
 
 User Question: {user_query}
 
@@ -95,8 +206,21 @@ Please provide a helpful answer based on the context provided. If the context do
     
     return prompt
 
+def is_retryable(exc):
+    """Whether a Bedrock call failed with a throttling or server error"""
+    if not isinstance(exc, ClientError):
+        return False
+    status = exc.response.get("ResponseMetadata", {}).get("HTTPStatusCode", 0)
+    return status == 429 or status >= 500
+
+@retry(
+    retry=retry_if_exception(is_retryable),
+    wait=wait_exponential_jitter(initial=0.5, max=8),
+    stop=stop_after_attempt(5),
+    reraise=True
+)
 def ask_ai(prompt):
-    """Send a prompt to the AI and return the response"""
+    """Send a prompt to the AI and return the response text, or None if there is none"""
     messages = [
         {"role": "user", "content": prompt}
     ]
@@ -108,48 +232,65 @@ def ask_ai(prompt):
 
     response = client.invoke_model(
         modelId=model_id,
-        body=json.dumps(body)
+        body=orjson.dumps(body)
     )
 
-    response_body = json.loads(response["body"].read())
+    response_body = orjson.loads(response["body"].read())
 
     if "choices" in response_body and len(response_body["choices"]) > 0:
-        return response_body["choices"][0]["message"]["content"]
-    else:
-        return "Error: No response from AI"
+        return response_body["choices"][0]["message"].get("content")
+    return None
 
 if __name__ == "__main__":
     if len(sys.argv) < 2:
-        print("Usage: python aws-chat-rag-milvus-simple.py <your_question>")
-        print("Example: python aws-chat-rag-milvus-simple.py 'what are Legus favorite foods'")
+        print("Usage: python aws-chat-rag-milvus.py <your_question>")
+        print("       python aws-chat-rag-milvus.py --serve")
+        print("Example: python aws-chat-rag-milvus.py 'what are Legus favorite foods'")
         sys.exit(1)
 
+    if sys.argv[1:] == ["--serve"]:
+        serve()
+        sys.exit(0)
+
     user_prompt = " ".join(sys.argv[1:])
 
     print(f"Question: {user_prompt}")
-    print("\nConnecting to Milvus...")
-    
+
+    cache = QueryCache()
+
+    cached_answer = cache.get_exact(user_prompt, model_id)
+    if cached_answer is not None:
+        print("\nAnswer served from cache.")
+        print(f"\nAssistant Response: {cached_answer}")
+        sys.exit(0)
+
     try:
-        milvus_rag.connect()
-        
         print("Searching knowledge base...")
         
-        relevant_docs = milvus_rag.retrieve_relevant_docs(user_prompt, top_k=3)
+        query_embedding, retrieved = search_knowledge_base(user_prompt, top_k=3)
+        doc_ids = [doc.id for doc in retrieved.docs]
         
-        print(f"Found {len(relevant_docs)} relevant documents")
-        for i, doc in enumerate(relevant_docs):
-            print(f"Document {i+1} (score: {doc['score']:.3f}): {doc['title']}")
+        print(f"Found {len(retrieved.docs)} relevant documents")
+        for i, doc in enumerate(retrieved.docs):
+            print(f"Document {i+1} (score: {doc.score:.3f}): {doc.title}")
         
-        if relevant_docs:
-            rag_prompt = create_rag_prompt(user_prompt, relevant_docs)
+        cached_entry = cache.find_similar(query_embedding, model_id)
+        if cached_entry and cache.is_grounded(cached_entry, doc_ids):
+            print(f"\nAnswer served from cache (similarity: {cached_entry['similarity']:.3f}).")
+            response = cached_entry['answer']
+        elif retrieved.docs:
+            rag_prompt = create_rag_prompt(user_prompt, retrieved)
             
             print("\nGenerating response with context...")
             response = ask_ai(rag_prompt)
-            print(f"\nAssistant Response: {response}")
+            if response:
+                cache.put(user_prompt, model_id, query_embedding, response, doc_ids)
         else:
             print("No relevant documents found. Asking AI without context...")
             response = ask_ai(user_prompt)
-            print(f"\nAssistant Response: {response}")
+            if response:
+                cache.put(user_prompt, model_id, query_embedding, response)
+        print(f"\nAssistant Response: {response or 'Error: No response from AI'}")
     
     except Exception as e:
         print(f"Error: {e}")
@@ -1,71 +1,95 @@
+import asyncio
 import boto3
+import concurrent.futures
+import httpx
 import json
+import orjson
 import os
 import sys
+from urllib.parse import quote
+from botocore.auth import SigV4Auth
+from botocore.awsrequest import AWSRequest
 from dotenv import load_dotenv
-from pinecone import Pinecone
-from sentence_transformers import SentenceTransformer
+from pinecone.grpc import PineconeGRPC
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential_jitter
+from cache import QueryCache
+from documents import Doc, RetrievalResult
+from embedding import encode
 
 load_dotenv()
 
-client = boto3.client("bedrock-runtime", region_name="us-east-1")
+AWS_REGION = "us-east-1"
+BEDROCK_ENDPOINT = f"https://bedrock-runtime.{AWS_REGION}.amazonaws.com"
 model_id = "qwen.qwen3-coder-30b-a3b-v1:0"
 
-pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
-index = pc.Index("nimonik-rag")
+credentials = boto3.Session().get_credentials()
+http_client = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(max_keepalive_connections=20),
+    timeout=httpx.Timeout(60.0)
+)
+
+executor = concurrent.futures.ThreadPoolExecutor(max_workers=8)
 
-embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+UNKNOWN_ANSWER = "I don't know"
 
-def get_embedding(text):
-    """Generate embedding for the given text"""
-    return embedding_model.encode(text).tolist()
+pc = PineconeGRPC(api_key=os.getenv("PINECONE_API_KEY"))
+index = pc.Index("nimonik-rag")
 
-def retrieve_relevant_docs(query, top_k=3):
+def get_embedding(texts):
+    """Generate normalized float32 embeddings for a text or a list of texts"""
+    if isinstance(texts, str):
+        return encode([texts])[0]
+    return encode(texts)
+
+def retrieve_relevant_docs(query, top_k=3, query_embedding=None):
     """Retrieve relevant documents from Pinecone based on the query"""
-    query_embedding = get_embedding(query)
+    if query_embedding is None:
+        query_embedding = get_embedding(query)
 
     results = index.query(
-        vector=query_embedding,
+        vector=query_embedding.tolist(),
         top_k=top_k,
         include_metadata=True
     )
     
-    relevant_docs = []
-    for match in results.matches:
-        relevant_docs.append({
-            'content': match.metadata.get('text', ''),
-            'score': match.score
-        })
-    
-    return relevant_docs
+    return RetrievalResult.from_docs([
+        Doc(id=match.id, content=match.metadata.get('text', ''), score=match.score)
+        for match in results.matches
+    ])
 
 def create_initial_prompt(user_query):
     """Create initial prompt to check if AI knows the answer"""
     prompt = f"""Please answer the following question: {user_query}
 
-If you don't have enough information to provide a confident answer, please respond with exactly "I don't know" and nothing else. Otherwise, provide your answer based on your knowledge."""
+If you don't have enough information to provide a confident answer, please respond with exactly "{UNKNOWN_ANSWER}" and nothing else. Otherwise, provide your answer based on your knowledge."""
     
     return prompt
 
+def is_unknown_answer(content):
+    """Check whether the AI answered with the "I don't know" sentinel"""
+    normalized = (content or "").strip().rstrip(".").replace("\u2019", "'").lower()
+    return normalized == UNKNOWN_ANSWER.lower()
+
 def create_system_prompt_with_tools():
     """Create system prompt that instructs AI to use function calling when needed"""
-    return """You are a helpful assistant with access to a knowledge base search function. 
+    return f"""You are a helpful assistant with access to a knowledge base search function. 
 
 When a user asks a question:
 1. First, try to answer based on your general knowledge
 2. If you don't know the answer or need more specific information, use the search_knowledge_base function to find relevant information
 3. Then provide a comprehensive answer based on the search results
 
+If you can neither answer nor search, respond with exactly "{UNKNOWN_ANSWER}" and nothing else.
+
 Always be helpful and provide accurate information."""
 
-def create_rag_prompt(user_query, relevant_docs):
+def create_rag_prompt(user_query, retrieved):
     """Create a prompt that includes retrieved context"""
-    context = "\n\n".join([doc['content'] for doc in relevant_docs])
-    
     prompt = f"""Based on the following context, please answer the user's question:
 
 Context:
-{context}
+{retrieved.context_blob}
 
 User Question: {user_query}
 
@@ -100,26 +124,65 @@ def create_search_tool():
         }
     ]
 
-def handle_function_call(function_name, arguments):
+def handle_function_call(function_name, arguments, prefetched_docs=None):
     """Handle function calls from the AI"""
     if function_name == "search_knowledge_base":
         query = arguments.get("query", "")
         top_k = arguments.get("top_k", 3)
         
         print(f"\nSearching knowledge base for: {query}")
-        relevant_docs = retrieve_relevant_docs(query, top_k=top_k)
+        retrieved = (prefetched_docs or {}).get((query, top_k))
+        if retrieved is None:
+            retrieved = retrieve_relevant_docs(query, top_k=top_k)
         
-        print(f"Found {len(relevant_docs)} relevant documents")
-        for i, doc in enumerate(relevant_docs):
-            print(f"Document {i+1} (score: {doc['score']:.3f}): {doc['content'][:100]}...")
+        print(f"Found {len(retrieved.docs)} relevant documents")
+        for i, doc in enumerate(retrieved.docs):
+            print(f"Document {i+1} (score: {doc.score:.3f}): {doc.content[:100]}...")
         
-        context = "\n\n".join([doc['content'] for doc in relevant_docs])
-        return f"Search results for '{query}':\n\n{context}"
+        return f"Search results for '{query}':\n\n{retrieved.context_blob}", retrieved.docs
     
-    return "Function not found"
+    return "Function not found", []
+
+def is_retryable(exc):
+    """Whether a Bedrock call failed with a throttling, server or connection error"""
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code == 429 or exc.response.status_code >= 500
+    return isinstance(exc, httpx.TransportError)
 
-def ask_ai(prompt, tools=None, system_prompt=None):
-    """Send a prompt to the AI and return the response"""
+@retry(
+    retry=retry_if_exception(is_retryable),
+    wait=wait_exponential_jitter(initial=0.5, max=8),
+    stop=stop_after_attempt(5),
+    reraise=True
+)
+async def invoke_model(body):
+    """Call Bedrock and return the first choice's message, or None if there is none"""
+    data = orjson.dumps(body)
+    request = AWSRequest(
+        method="POST",
+        url=f"{BEDROCK_ENDPOINT}/model/{quote(model_id, safe='')}/invoke",
+        data=data,
+        headers={"Content-Type": "application/json", "Accept": "application/json"}
+    )
+    SigV4Auth(credentials.get_frozen_credentials(), "bedrock", AWS_REGION).add_auth(request)
+    prepped = request.prepare()
+
+    response = await http_client.post(prepped.url, headers=dict(prepped.headers), content=data)
+    response.raise_for_status()
+
+    response_body = orjson.loads(response.content)
+
+    if "choices" in response_body and len(response_body["choices"]) > 0:
+        return response_body["choices"][0]["message"]
+    return None
+
+async def run_in_executor(func, *args):
+    """Run a blocking call on the shared thread pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, func, *args)
+
+async def ask_ai(prompt, tools=None, system_prompt=None):
+    """Send a prompt to the AI and return the response message, or None if there is none"""
     messages = []
     
     if system_prompt:
@@ -135,70 +198,121 @@ def ask_ai(prompt, tools=None, system_prompt=None):
     if tools:
         body["tools"] = tools
 
-    response = client.invoke_model(
-        modelId=model_id,
-        body=json.dumps(body)
+    return await invoke_model(body)
+
+async def run_tool_call(tool_call, prefetched_docs):
+    """Run one tool call and return its tool message and the documents it retrieved"""
+    function_name = tool_call["function"]["name"]
+    arguments = json.loads(tool_call["function"]["arguments"])
+    
+    function_result, relevant_docs = await run_in_executor(
+        handle_function_call, function_name, arguments, prefetched_docs
     )
+    
+    tool_message = {
+        "role": "tool",
+        "tool_call_id": tool_call["id"],
+        "content": function_result
+    }
+    return tool_message, relevant_docs
 
-    response_body = json.loads(response["body"].read())
+async def main(user_prompt):
+    try:
+        await answer_question(user_prompt)
+    finally:
+        await http_client.aclose()
 
-    if "choices" in response_body and len(response_body["choices"]) > 0:
-        return response_body["choices"][0]["message"]
-    else:
-        return {"content": "Error: No response from AI"}
+async def answer_question(user_prompt):
+    print(f"Question: {user_prompt}")
+
+    cache = QueryCache()
 
-if len(sys.argv) < 2:
-    print("Usage: python aws-chat-rag.py <your_question>")
-    print("Example: python aws-chat-rag.py 'what is the temperature in amsterdam'")
-    sys.exit(1)
+    cached_answer = cache.get_exact(user_prompt, model_id)
+    if cached_answer is not None:
+        print("\nAnswer served from cache.")
+        print("Final Assistant Response:", cached_answer)
+        return
 
-user_prompt = " ".join(sys.argv[1:])
+    query_embedding = get_embedding(user_prompt)
 
-print(f"Question: {user_prompt}")
-print("\nUsing function calling to answer the question...")
+    # Speculatively retrieve for the user's own prompt while the model decides
+    # whether it needs to search; a tool call for the same query reuses the
+    # result, and it is simply dropped if the model answers directly.
+    retrieval = asyncio.get_running_loop().run_in_executor(
+        executor, retrieve_relevant_docs, user_prompt, 3, query_embedding
+    )
 
-system_prompt = create_system_prompt_with_tools()
-tools = create_search_tool()
+    cached_entry = cache.find_similar(query_embedding, model_id)
+    if cached_entry:
+        retrieved = await retrieval
+        if cache.is_grounded(cached_entry, [doc.id for doc in retrieved.docs]):
+            print(f"\nAnswer served from cache (similarity: {cached_entry['similarity']:.3f}).")
+            print("Final Assistant Response:", cached_entry['answer'])
+            return
 
-response = ask_ai(user_prompt, tools=tools, system_prompt=system_prompt)
+    print("\nUsing function calling to answer the question...")
 
-if "tool_calls" in response and response["tool_calls"]:
-    print("\nAI is calling functions to search for information...")
-    
-    for tool_call in response["tool_calls"]:
-        function_name = tool_call["function"]["name"]
-        arguments = json.loads(tool_call["function"]["arguments"])
+    system_prompt = create_system_prompt_with_tools()
+    tools = create_search_tool()
+
+    response = await ask_ai(user_prompt, tools=tools, system_prompt=system_prompt)
+    if response is None:
+        retrieval.cancel()
+        print("\nError: No response from AI")
+        return
+
+    if "tool_calls" in response and response["tool_calls"]:
+        print("\nAI is calling functions to search for information...")
         
-        function_result = handle_function_call(function_name, arguments)
+        prefetched_docs = {(user_prompt, 3): await retrieval}
+        tool_results = await asyncio.gather(*(
+            run_tool_call(tool_call, prefetched_docs)
+            for tool_call in response["tool_calls"]
+        ))
         
         follow_up_messages = [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt},
-            response,
-            {
-                "role": "tool",
-                "tool_call_id": tool_call["id"],
-                "content": function_result
-            }
-        ]
+            response
+        ] + [tool_message for tool_message, _ in tool_results]
         
         body = {
             "messages": follow_up_messages,
             "max_tokens": 512
         }
         
-        final_response = client.invoke_model(
-            modelId=model_id,
-            body=json.dumps(body)
-        )
-        
-        final_response_body = json.loads(final_response["body"].read())
+        final_message = await invoke_model(body)
         
-        if "choices" in final_response_body and len(final_response_body["choices"]) > 0:
-            final_content = final_response_body["choices"][0]["message"]["content"]
-            print("\nFinal Assistant Response:", final_content)
+        if final_message is not None:
+            print("\nFinal Assistant Response:", final_message.get("content", "No content in response"))
+            if final_message.get("content"):
+                cache.put(user_prompt, model_id, query_embedding, final_message["content"],
+                          [doc.id for _, relevant_docs in tool_results for doc in relevant_docs])
         else:
             print("\nError: No final response from AI")
-else:
-    print("\nAI provided an answer without needing to search.")
-    print("Final Assistant Response:", response.get("content", "No content in response"))
+    elif is_unknown_answer(response.get("content")):
+        print("\nAI doesn't know the answer; answering from the knowledge base...")
+        
+        retrieved = await retrieval
+        final_message = await ask_ai(create_rag_prompt(user_prompt, retrieved))
+        if final_message is None:
+            print("Error: No final response from AI")
+            return
+        print("Final Assistant Response:", final_message.get("content", "No content in response"))
+        if final_message.get("content"):
+            cache.put(user_prompt, model_id, query_embedding, final_message["content"],
+                      [doc.id for doc in retrieved.docs])
+    else:
+        retrieval.cancel()
+        print("\nAI provided an answer without needing to search.")
+        print("Final Assistant Response:", response.get("content", "No content in response"))
+        if response.get("content"):
+            cache.put(user_prompt, model_id, query_embedding, response["content"])
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python aws-chat-rag.py <your_question>")
+        print("Example: python aws-chat-rag.py 'what is the temperature in amsterdam'")
+        sys.exit(1)
+
+    asyncio.run(main(" ".join(sys.argv[1:])))
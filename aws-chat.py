@@ -1,8 +1,15 @@
 import boto3
-import json
+import orjson
 import sys
+from botocore.config import Config
 
-client = boto3.client("bedrock-runtime", region_name="us-east-1")
+bedrock_config = Config(
+    region_name="us-east-1",
+    max_pool_connections=50,
+    retries={"max_attempts": 3, "mode": "adaptive"},
+    tcp_keepalive=True
+)
+client = boto3.client("bedrock-runtime", config=bedrock_config)
 
 model_id = "qwen.qwen3-coder-30b-a3b-v1:0"
 
@@ -24,10 +31,10 @@ body = {
 
 response = client.invoke_model(
     modelId=model_id,
-    body=json.dumps(body)
+    body=orjson.dumps(body)
 )
 
-response_body = json.loads(response["body"].read())
+response_body = orjson.loads(response["body"].read())
 
 if "choices" in response_body and len(response_body["choices"]) > 0:
     assistant_content = response_body["choices"][0]["message"]["content"]
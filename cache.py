@@ -0,0 +1,219 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+
+CACHE_PATH = os.getenv("RAG_CACHE_PATH", ".rag_cache.sqlite3")
+SIMILARITY_THRESHOLD = 0.95
+MIN_DOC_OVERLAP = 0.7
+SQLITE_MAX_VARIABLES = 500
+
+class QueryCache:
+    def __init__(self, path: str = CACHE_PATH,
+                 similarity_threshold: float = SIMILARITY_THRESHOLD,
+                 min_doc_overlap: float = MIN_DOC_OVERLAP):
+        """
+        Initialize the query-answer cache.
+
+        Args:
+            path: Path to the SQLite cache file
+            similarity_threshold: Minimum cosine similarity for a semantic hit
+            min_doc_overlap: Minimum Jaccard overlap between the retrieved
+                document IDs of a semantic hit and the cached entry
+        """
+        self.similarity_threshold = similarity_threshold
+        self.min_doc_overlap = min_doc_overlap
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS answers (
+                query_hash TEXT PRIMARY KEY,
+                model_id TEXT NOT NULL,
+                query_embedding BLOB NOT NULL,
+                answer TEXT NOT NULL,
+                doc_ids TEXT NOT NULL,
+                ts REAL NOT NULL
+            )
+            """
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS answers_model_id ON answers (model_id)")
+        self.conn.commit()
+
+    @staticmethod
+    def hash_query(prompt: str, model_id: str) -> str:
+        """Return the exact-match key for a prompt and model."""
+        return hashlib.sha256(f"{model_id}\x00{prompt}".encode("utf-8")).hexdigest()
+
+    def get_exact(self, prompt: str, model_id: str) -> Optional[str]:
+        """Return the cached answer for exactly this prompt, if any."""
+        row = self.conn.execute(
+            "SELECT answer FROM answers WHERE query_hash = ?",
+            (self.hash_query(prompt, model_id),)
+        ).fetchone()
+        return row[0] if row else None
+
+    def find_similar(self, query_embedding, model_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Find the most similar cached query above the similarity threshold.
+
+        Entries cached without any retrieved documents are only ever served
+        on an exact match, since there is no evidence to validate them against.
+
+        Args:
+            query_embedding: Embedding of the new query
+            model_id: Model the answer must have been produced by
+
+        Returns:
+            Dictionary with the cached answer, doc_ids and similarity, or None
+        """
+        rows = self.conn.execute(
+            "SELECT query_embedding, answer, doc_ids FROM answers "
+            "WHERE model_id = ? AND doc_ids != '[]'",
+            (model_id,)
+        ).fetchall()
+        if not rows:
+            return None
+
+        # Numba is only loaded once a semantic lookup actually has entries to scan
+        from similarity import topk_cosine
+
+        cache_matrix = np.stack([np.frombuffer(row[0], dtype=np.float32) for row in rows])
+        q = np.ascontiguousarray(query_embedding, dtype=np.float32)
+        q = q / np.linalg.norm(q)
+
+        indices, similarities = topk_cosine(cache_matrix, q, 1)
+        best = int(indices[0])
+        if similarities[0] < self.similarity_threshold:
+            return None
+
+        return {
+            'answer': rows[best][1],
+            'doc_ids': json.loads(rows[best][2]),
+            'similarity': float(similarities[0])
+        }
+
+    def is_grounded(self, entry: Dict[str, Any], doc_ids: List[str]) -> bool:
+        """Check that a semantic hit is backed by the same evidence as the new query."""
+        cached = set(entry['doc_ids'])
+        current = set(doc_ids)
+        if not cached or not current:
+            return False
+        return len(cached & current) / len(cached | current) >= self.min_doc_overlap
+
+    def put(self, prompt: str, model_id: str, query_embedding, answer: str,
+            doc_ids: Optional[List[str]] = None):
+        """
+        Store an answer in the cache.
+
+        Args:
+            prompt: User prompt the answer was generated for
+            model_id: Model that produced the answer
+            query_embedding: Embedding of the prompt
+            answer: Final answer text
+            doc_ids: IDs of the documents the answer was grounded on
+        """
+        q = np.asarray(query_embedding, dtype=np.float32)
+        q = q / np.linalg.norm(q)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                self.hash_query(prompt, model_id),
+                model_id,
+                q.tobytes(),
+                answer,
+                json.dumps(sorted(doc_ids or [])),
+                time.time()
+            )
+        )
+        self.conn.commit()
+
+    def close(self):
+        """Close the underlying database connection."""
+        self.conn.close()
+
+class EmbeddingCache:
+    def __init__(self, path: str = CACHE_PATH, dtype=np.float32):
+        """
+        Initialize the embedding cache.
+
+        The connection is shared between threads, so access is serialized
+        with a lock. Embeddings stored with a different dtype than float32
+        live in their own table.
+
+        Args:
+            path: Path to the SQLite cache file
+            dtype: Storage dtype of the embeddings, e.g. np.float16 to halve
+                the cache size; lookups always return float32
+        """
+        self.dtype = np.dtype(dtype)
+        self.table = "embeddings" if self.dtype == np.float32 else f"embeddings_{self.dtype.name}"
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.lock:
+            self.conn.execute(
+                f"""
+                CREATE TABLE IF NOT EXISTS {self.table} (
+                    key TEXT PRIMARY KEY,
+                    embedding BLOB NOT NULL
+                )
+                """
+            )
+            self.conn.commit()
+
+    @staticmethod
+    def hash_text(model_id: str, text: str) -> str:
+        """Return the cache key for a text embedded by the given model."""
+        return hashlib.sha256(f"{model_id}\x00{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, model_id: str, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """
+        Look up cached embeddings for several texts at once.
+
+        Args:
+            model_id: Identifier of the embedding model
+            texts: Texts to look up
+
+        Returns:
+            List aligned with texts holding each cached embedding, or None on a miss
+        """
+        keys = [self.hash_text(model_id, text) for text in texts]
+        found = {}
+        with self.lock:
+            for start in range(0, len(keys), SQLITE_MAX_VARIABLES):
+                batch = keys[start:start + SQLITE_MAX_VARIABLES]
+                placeholders = ",".join("?" * len(batch))
+                found.update(self.conn.execute(
+                    f"SELECT key, embedding FROM {self.table} WHERE key IN ({placeholders})",
+                    batch
+                ).fetchall())
+
+        return [
+            np.frombuffer(found[key], dtype=self.dtype).astype(np.float32, copy=False) if key in found else None
+            for key in keys
+        ]
+
+    def put_many(self, model_id: str, texts: List[str], embeddings):
+        """
+        Store embeddings for several texts.
+
+        Args:
+            model_id: Identifier of the embedding model
+            texts: Texts that were embedded
+            embeddings: Embeddings aligned with texts
+        """
+        rows = [
+            (self.hash_text(model_id, text), np.asarray(embedding).astype(self.dtype).tobytes())
+            for text, embedding in zip(texts, embeddings)
+        ]
+        with self.lock:
+            self.conn.executemany(f"INSERT OR REPLACE INTO {self.table} VALUES (?, ?)", rows)
+            self.conn.commit()
+
+    def close(self):
+        """Close the underlying database connection."""
+        self.conn.close()
@@ -0,0 +1,28 @@
+from typing import List, NamedTuple
+
+import msgspec
+
+class Doc(msgspec.Struct, frozen=True):
+    """A retrieved document chunk."""
+    id: str
+    content: str
+    score: float
+    title: str = ""
+    source: str = ""
+    chunk_index: int = 0
+    total_chunks: int = 1
+
+class RetrievalResult(NamedTuple):
+    """Retrieved documents together with their joined context."""
+    docs: List[Doc]
+    context_blob: str
+
+    @classmethod
+    def from_docs(cls, docs: List[Doc]) -> "RetrievalResult":
+        """Build a result, joining the document contents once."""
+        return cls(docs, "\n\n".join(doc.content for doc in docs))
+
+class RetrievalResponse(msgspec.Struct):
+    """Wire format of a retrieval server reply."""
+    embedding: List[float]
+    docs: List[Doc]
@@ -0,0 +1,127 @@
+import functools
+import json
+import os
+import socket
+import struct
+from typing import List, Optional
+
+import numpy as np
+
+from cache import EmbeddingCache
+
+MODEL_NAME = 'all-MiniLM-L6-v2'
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "onnx")
+ONNX_MODEL_FILE = "onnx/model_qint8_avx512_vnni.onnx"
+EMBEDDING_MODEL_ID = f"{MODEL_NAME}:{EMBEDDING_BACKEND}"
+SOCKET_PATH = os.getenv("EMBEDDING_SOCKET", "/tmp/rag-embedding.sock")
+SOCKET_TIMEOUT = float(os.getenv("EMBEDDING_SOCKET_TIMEOUT", "30"))
+
+@functools.lru_cache(maxsize=1)
+def get_model():
+    """
+    Load the embedding model once per process.
+
+    With the default ONNX backend the int8 (AVX-512 VNNI) quantized export
+    of the model shipped on the Hugging Face hub is run by ONNX Runtime with
+    all graph optimizations enabled and one intra-op thread per core. The
+    device can be forced with EMBEDDING_DEVICE and defaults to CUDA when
+    available.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // 2))
+    device = os.getenv("EMBEDDING_DEVICE") or ("cuda" if torch.cuda.is_available() else "cpu")
+
+    if EMBEDDING_BACKEND == "onnx":
+        import onnxruntime as ort
+
+        session_options = ort.SessionOptions()
+        session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        session_options.intra_op_num_threads = os.cpu_count() or 1
+
+        model = SentenceTransformer(
+            MODEL_NAME,
+            device=device,
+            backend="onnx",
+            model_kwargs={"file_name": ONNX_MODEL_FILE, "session_options": session_options}
+        )
+    else:
+        model = SentenceTransformer(MODEL_NAME, device=device)
+
+    model.eval()
+    return model
+
+def encode_local(texts: List[str], batch_size: int = 64, show_progress_bar: bool = False) -> np.ndarray:
+    """
+    Encode texts with the in-process model.
+
+    sentence-transformers already sorts each call's inputs by length before
+    batching, so padding per batch stays minimal.
+    """
+    import torch
+
+    with torch.inference_mode():
+        embeddings = get_model().encode(
+            texts,
+            batch_size=batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=show_progress_bar
+        )
+    return embeddings.astype(np.float32, copy=False)
+
+@functools.lru_cache(maxsize=1)
+def get_embedding_cache() -> EmbeddingCache:
+    """Open the shared embedding cache on first use rather than at import."""
+    return EmbeddingCache()
+
+def encode_remote(texts: List[str]):
+    """
+    Encode texts with the embedding daemon.
+
+    Returns:
+        Array of shape (len(texts), dim), or None if the daemon isn't running,
+        times out or closes the connection without a complete reply
+    """
+    if not hasattr(socket, "AF_UNIX"):
+        return None
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(SOCKET_TIMEOUT)
+            sock.connect(SOCKET_PATH)
+            sock.sendall(json.dumps(texts).encode('utf-8') + b"\n")
+            with sock.makefile('rb') as f:
+                rows, dim = struct.unpack('<II', f.read(8))
+                data = f.read(rows * dim * 4)
+    except (OSError, struct.error):
+        return None
+
+    if rows != len(texts) or len(data) != rows * dim * 4:
+        return None
+
+    return np.frombuffer(data, dtype=np.float32).reshape(rows, dim)
+
+def encode(texts: List[str], cache: Optional[EmbeddingCache] = None) -> np.ndarray:
+    """
+    Encode texts, reusing cached embeddings by content hash.
+
+    Only the texts missing from the cache are encoded, in one batch, via the
+    daemon if it is running and otherwise in-process. The shared embedding
+    cache is used unless another one is given.
+    """
+    cache = cache or get_embedding_cache()
+    embeddings = cache.get_many(EMBEDDING_MODEL_ID, texts)
+    misses = [i for i, embedding in enumerate(embeddings) if embedding is None]
+
+    if misses:
+        miss_texts = [texts[i] for i in misses]
+        encoded = encode_remote(miss_texts)
+        if encoded is None:
+            encoded = encode_local(miss_texts)
+        cache.put_many(EMBEDDING_MODEL_ID, miss_texts, encoded)
+        for i, embedding in zip(misses, encoded):
+            embeddings[i] = embedding
+
+    return np.stack(embeddings)
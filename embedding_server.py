@@ -0,0 +1,30 @@
+import json
+import os
+import socketserver
+import struct
+
+from embedding import MODEL_NAME, EMBEDDING_BACKEND, SOCKET_PATH, encode_local
+
+class EmbeddingRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        """Read a JSON list of texts and reply with a float32 embedding matrix."""
+        texts = json.loads(self.rfile.readline())
+        embeddings = encode_local(texts).reshape(len(texts), -1)
+        self.wfile.write(struct.pack('<II', *embeddings.shape))
+        self.wfile.write(embeddings.tobytes())
+
+if __name__ == "__main__":
+    print(f"Loading embedding model: {MODEL_NAME} (backend: {EMBEDDING_BACKEND})")
+    encode_local(["warm up"])
+
+    if os.path.exists(SOCKET_PATH):
+        os.remove(SOCKET_PATH)
+
+    with socketserver.UnixStreamServer(SOCKET_PATH, EmbeddingRequestHandler) as server:
+        print(f"Embedding server listening on {SOCKET_PATH}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print("\nShutting down embedding server")
+        finally:
+            os.remove(SOCKET_PATH)
@@ -1,19 +1,56 @@
 import os
+import io
 import json
+import mmap
 import pickle
-from typing import List, Dict, Any
+from itertools import islice
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Iterator, Tuple
+import ijson
+import numpy as np
+import orjson
+import pyarrow as pa
+import pyarrow.parquet as pq
 from dotenv import load_dotenv
 from pinecone import Pinecone
 
 load_dotenv()
 
-def export_pinecone_data(index_name: str = "nimonik-rag", output_file: str = "pinecone_export.json"):
+def export_schema(dim: int) -> pa.Schema:
     """
-    Export all vectors and metadata from Pinecone index to a JSON file.
+    Parquet schema of an export file.
+    
+    Vectors are stored as fixed-size float32 lists; metadata keys vary per
+    vector, so metadata is stored as a JSON string.
+    
+    Args:
+        dim: Vector dimension
+        
+    Returns:
+        Arrow schema with id, values and metadata columns
+    """
+    return pa.schema([
+        ('id', pa.string()),
+        ('values', pa.list_(pa.float32(), dim)),
+        ('metadata', pa.string())
+    ])
+
+def export_pinecone_data(index_name: str = "nimonik-rag", output_file: str = "pinecone_export.parquet",
+                         batch_size: int = 100, max_workers: int = 8):
+    """
+    Export all vectors and metadata from Pinecone index to a Parquet file.
+    
+    Vector IDs are paged with the list API and fetched in parallel, with at
+    most two fetches per worker in flight. Fetched batches are written out
+    in list order as zstd-compressed row groups, so memory stays bounded by
+    the number of in-flight fetches rather than the index size.
     
     Args:
         index_name: Name of the Pinecone index to export
         output_file: Output file path for the exported data
+        batch_size: Number of vector IDs to fetch per request
+        max_workers: Number of concurrent fetch requests
     """
     print(f"Connecting to Pinecone index: {index_name}")
     
@@ -30,62 +67,98 @@ def export_pinecone_data(index_name: str = "nimonik-rag", output_file: str = "pi
         print("No vectors found in the index.")
         return
     
-    exported_data = []
-    batch_size = 100
-    
-    dummy_vector = [0.0] * 384
+    exported_count = 0
+    sample = None
     
     print("Starting export process...")
     
-    try:
-        results = index.query(
-            vector=dummy_vector,
-            top_k=total_vectors,
-            include_metadata=True,
-            include_values=True
-        )
+    writer = None
+    
+    def write_batch(fetched):
+        nonlocal writer, sample, exported_count
+        vectors = list(fetched.vectors.values())
+        if not vectors:
+            return
+        
+        values = np.asarray([vector.values for vector in vectors], dtype=np.float32)
+        if writer is None:
+            writer = pq.ParquetWriter(output_file, export_schema(values.shape[1]), compression='zstd')
         
-        print(f"Retrieved {len(results.matches)} vectors")
+        writer.write_table(pa.table({
+            'id': [vector.id for vector in vectors],
+            'values': pa.FixedSizeListArray.from_arrays(pa.array(values.ravel()), values.shape[1]),
+            'metadata': [json.dumps(vector.metadata, ensure_ascii=False) for vector in vectors]
+        }, schema=writer.schema))
         
-        for match in results.matches:
-            vector_data = {
-                'id': match.id,
-                'values': match.values,
-                'metadata': match.metadata,
-                'score': match.score
-            }
-            exported_data.append(vector_data)
+        if sample is None:
+            sample = {'id': vectors[0].id, 'values': vectors[0].values, 'metadata': vectors[0].metadata}
+        exported_count += len(vectors)
         
-        print(f"Successfully exported {len(exported_data)} vectors")
+        print(f"Exported {exported_count}/{total_vectors} vectors")
+    
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = deque()
+            for ids in index.list(prefix="", limit=batch_size):
+                if len(pending) >= max_workers * 2:
+                    write_batch(pending.popleft().result())
+                pending.append(executor.submit(index.fetch, ids=ids))
+            
+            while pending:
+                write_batch(pending.popleft().result())
         
     except Exception as e:
         print(f"Error during export: {e}")
-        print("Trying alternative method...")
-        
-        print("Note: This method requires knowing vector IDs. Consider using the Pinecone console to get IDs.")
         return
-    
-    print(f"Saving exported data to {output_file}")
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(exported_data, f, indent=2, ensure_ascii=False)
-    
-    pickle_file = output_file.replace('.json', '.pkl')
-    with open(pickle_file, 'wb') as f:
-        pickle.dump(exported_data, f)
+    finally:
+        if writer is not None:
+            writer.close()
     
     print(f"Export complete!")
-    print(f"JSON file: {output_file}")
-    print(f"Pickle file: {pickle_file}")
-    print(f"Total vectors exported: {len(exported_data)}")
+    print(f"Parquet file: {output_file}")
+    print(f"Total vectors exported: {exported_count}")
     
-    if exported_data:
+    if sample:
         print("\nSample of exported data:")
-        sample = exported_data[0]
         print(f"ID: {sample['id']}")
         print(f"Vector dimensions: {len(sample['values'])}")
         print(f"Metadata keys: {list(sample['metadata'].keys())}")
         print(f"Sample metadata: {sample['metadata']}")
 
+def load_json_file(file_path: str) -> Any:
+    """
+    Parse a whole JSON file with orjson through a read-only memory map.
+    
+    Falls back to the standard library parser for documents orjson rejects,
+    such as ones containing NaN.
+    
+    Args:
+        file_path: Path to the JSON file
+        
+    Returns:
+        Parsed JSON document
+    """
+    with open(file_path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            with memoryview(mm) as view:
+                try:
+                    return orjson.loads(view)
+                except orjson.JSONDecodeError:
+                    return json.loads(bytes(view))
+
+def load_pickle_file(file_path: str) -> Any:
+    """
+    Unpickle a file through a 1 MiB read buffer.
+    
+    Args:
+        file_path: Path to the pickle file
+        
+    Returns:
+        Unpickled object
+    """
+    with open(file_path, 'rb', buffering=0) as raw:
+        return pickle.load(io.BufferedReader(raw, buffer_size=2**20))
+
 def load_exported_data(file_path: str) -> List[Dict[str, Any]]:
     """
     Load exported data from file.
@@ -97,11 +170,75 @@ def load_exported_data(file_path: str) -> List[Dict[str, Any]]:
         List of vector data dictionaries
     """
     if file_path.endswith('.pkl'):
+        return load_pickle_file(file_path)
+    elif file_path.endswith('.parquet'):
+        return [
+            {'id': row['id'], 'values': row['values'], 'metadata': json.loads(row['metadata'])}
+            for row in pq.read_table(file_path).to_pylist()
+        ]
+    elif file_path.endswith('.jsonl'):
         with open(file_path, 'rb') as f:
-            return pickle.load(f)
+            return [orjson.loads(line) for line in f]
     else:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        return load_json_file(file_path)
+
+def iter_exported_items(file_path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Iterate over the vectors of a JSON, JSON Lines or pickle export.
+    
+    JSON exports are parsed incrementally with ijson, so only the current
+    vector is held in memory. Pickle files cannot be streamed and are
+    loaded in full.
+    
+    Args:
+        file_path: Path to the exported data file
+        
+    Returns:
+        Iterator of vector data dictionaries
+    """
+    if file_path.endswith('.pkl'):
+        yield from load_pickle_file(file_path)
+    elif file_path.endswith('.jsonl'):
+        with open(file_path, 'rb') as f:
+            for line in f:
+                yield orjson.loads(line)
+    else:
+        with open(file_path, 'rb') as f:
+            yield from ijson.items(f, 'item', use_float=True)
+
+def iter_exported_batches(file_path: str, batch_size: int = 10000) -> Iterator[Tuple[List[str], np.ndarray, List[Dict[str, Any]]]]:
+    """
+    Iterate over exported data in column batches.
+    
+    Parquet exports are memory-mapped and read one record batch at a time.
+    Each batch's vectors are a float32 view over the decoded Arrow buffer, so
+    no per-float Python objects are built and memory stays bounded by the
+    batch size. Other formats are streamed with iter_exported_items().
+    
+    Args:
+        file_path: Path to the exported data file
+        batch_size: Number of vectors per batch
+        
+    Returns:
+        Iterator of (ids, vectors, metadata) tuples, with vectors as a
+        float32 array of shape (n, dim)
+    """
+    if file_path.endswith('.parquet'):
+        parquet_file = pq.ParquetFile(file_path, memory_map=True)
+        for batch in parquet_file.iter_batches(batch_size=batch_size):
+            values = batch.column('values')
+            vectors = values.flatten().to_numpy(zero_copy_only=True).reshape(len(values), values.type.list_size)
+            metadata = [json.loads(m) for m in batch.column('metadata').to_pylist()]
+            yield batch.column('id').to_pylist(), vectors, metadata
+        return
+    
+    items = iter_exported_items(file_path)
+    while batch := list(islice(items, batch_size)):
+        yield (
+            [item['id'] for item in batch],
+            np.asarray([item['values'] for item in batch], dtype=np.float32),
+            [item['metadata'] for item in batch]
+        )
 
 if __name__ == "__main__":
     print("Pinecone Data Export Tool")
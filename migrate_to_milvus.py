@@ -1,34 +1,106 @@
+import hashlib
+import math
 import os
-import json
-import pickle
-from typing import List, Dict, Any, Optional
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import chain, islice
+from typing import List, Dict, Any, Iterable, Optional, Tuple
+import numpy as np
 from pymilvus import (
     connections, Collection, FieldSchema, CollectionSchema, DataType,
     utility, MilvusException
 )
 from dotenv import load_dotenv
+from export_pinecone_data import iter_exported_batches
+import text_store
 
 load_dotenv()
 
+INSERT_BATCH_SIZE = 10000
+DEFAULT_NLIST = 1024
+
+def choose_nlist(num_vectors: int) -> int:
+    """
+    Choose the number of IVF clusters for a collection size.
+    
+    Uses sqrt(N) above one million vectors and N / 1000 below that.
+    
+    Args:
+        num_vectors: Number of vectors in the collection
+        
+    Returns:
+        nlist for the IVF index
+    """
+    if num_vectors > 1_000_000:
+        return max(64, int(round(math.sqrt(num_vectors))))
+    return max(16, num_vectors // 1000)
+
+def hash_id(vector_id: str) -> int:
+    """
+    Map a string vector ID to a stable signed 64-bit primary key.
+    
+    Args:
+        vector_id: Original (Pinecone) vector ID
+        
+    Returns:
+        blake2b-derived INT64 key
+    """
+    return int.from_bytes(hashlib.blake2b(vector_id.encode('utf-8'), digest_size=8).digest(), 'little', signed=True)
+
+def as_int(value) -> int:
+    """Return value as an int, skipping the conversion when it already is one."""
+    return value if type(value) is int else int(value)
+
+def normalize_rows(vectors) -> np.ndarray:
+    """
+    L2-normalize vectors so inner product equals cosine similarity.
+    
+    Zero vectors are left as they are. The input is never modified, since
+    it may be a read-only view over an export file.
+    
+    Args:
+        vectors: float32 array of shape (n, dim) or (dim,)
+        
+    Returns:
+        Normalized float32 array of the same shape
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
 class MilvusManager:
-    def __init__(self, host: str = "localhost", port: str = "19530"):
+    def __init__(self, host: str = "localhost", port: str = "19530", index_type: str = "HNSW",
+                 M: int = 16, ef_construction: int = 200, ef: int = 64, num_connections: int = 4):
         """
         Initialize Milvus connection and manager.
         
         Args:
             host: Milvus server host
             port: Milvus server port
+            index_type: Vector index to build, "HNSW" or "IVF_SQ8"
+            M: Maximum number of graph neighbors per node (HNSW)
+            ef_construction: Candidate list size while building the graph (HNSW)
+            ef: Candidate list size at search time (HNSW)
+            num_connections: Number of gRPC connections that concurrent
+                inserts are spread across
         """
         self.host = host
         self.port = port
+        self.aliases = ["default"] + [f"insert_{i}" for i in range(1, num_connections)]
         self.collection_name = "nimonik_rag"
         self.collection = None
+        self.index_type = index_type
+        self.M = M
+        self.ef_construction = ef_construction
+        self.ef = ef
+        self.nlist = DEFAULT_NLIST
         
     def connect(self):
-        """Connect to Milvus server."""
+        """Open one keep-alive connection per alias to the Milvus server."""
         try:
-            connections.connect("default", host=self.host, port=self.port)
-            print(f"Connected to Milvus at {self.host}:{self.port}")
+            for alias in self.aliases:
+                connections.connect(alias, host=self.host, port=self.port, keep_alive=True)
+            print(f"Connected to Milvus at {self.host}:{self.port} ({len(self.aliases)} connections)")
         except Exception as e:
             print(f"Failed to connect to Milvus: {e}")
             raise
@@ -37,49 +109,65 @@ class MilvusManager:
         """
         Create collection schema matching Pinecone structure.
         
+        Scalar fields are memory-mapped so their pages can be evicted, while
+        the embedding field stays resident for random access during search.
+        
         Returns:
             CollectionSchema object for the RAG collection
         """
         fields = [
             FieldSchema(
-                name="id", 
-                dtype=DataType.VARCHAR, 
-                max_length=512, 
+                name="pk", 
+                dtype=DataType.INT64, 
                 is_primary=True,
-                description="Unique identifier for the vector"
+                auto_id=False,
+                description="64-bit hash of the original vector ID"
+            ),
+            FieldSchema(
+                name="orig_id", 
+                dtype=DataType.VARCHAR, 
+                max_length=512,
+                mmap_enabled=True,
+                description="Original vector ID"
             ),
             FieldSchema(
                 name="embedding", 
-                dtype=DataType.FLOAT_VECTOR, 
+                dtype=DataType.FLOAT16_VECTOR, 
                 dim=384,
+                mmap_enabled=False,
                 description="Text embedding vector"
             ),
             FieldSchema(
-                name="text", 
+                name="text_key", 
                 dtype=DataType.VARCHAR, 
-                max_length=65535,
-                description="Original text content"
+                max_length=128,
+                mmap_enabled=True,
+                description="Object storage key of the original text content"
             ),
             FieldSchema(
                 name="title", 
                 dtype=DataType.VARCHAR, 
                 max_length=1024,
+                mmap_enabled=True,
                 description="Document title"
             ),
             FieldSchema(
                 name="source", 
                 dtype=DataType.VARCHAR, 
                 max_length=1024,
+                mmap_enabled=True,
                 description="Document source"
             ),
             FieldSchema(
                 name="chunk_index", 
                 dtype=DataType.INT64,
+                mmap_enabled=True,
                 description="Chunk index within document"
             ),
             FieldSchema(
                 name="total_chunks", 
                 dtype=DataType.INT64,
+                mmap_enabled=True,
                 description="Total number of chunks in document"
             )
         ]
@@ -87,17 +175,19 @@ class MilvusManager:
         schema = CollectionSchema(
             fields=fields,
             description="RAG collection for document embeddings",
-            enable_dynamic_field=True
+            enable_dynamic_field=False
         )
         
         return schema
     
-    def create_collection(self, drop_existing: bool = False):
+    def create_collection(self, drop_existing: bool = False, defer_index: bool = True):
         """
         Create the collection in Milvus.
         
         Args:
             drop_existing: Whether to drop existing collection if it exists
+            defer_index: Skip building the index, so it can be built once
+                with create_index() after a bulk insert
         """
         try:
             if utility.has_collection(self.collection_name):
@@ -112,18 +202,10 @@ class MilvusManager:
             print(f"Creating collection: {self.collection_name}")
             schema = self.create_collection_schema()
             self.collection = Collection(self.collection_name, schema)
+            self.collection.set_properties({"mmap.enabled": False})
             
-            print("Creating index for embedding field...")
-            index_params = {
-                "metric_type": "COSINE",
-                "index_type": "IVF_FLAT",
-                "params": {"nlist": 1024}
-            }
-            
-            self.collection.create_index(
-                field_name="embedding",
-                index_params=index_params
-            )
+            if not defer_index:
+                self.create_index()
             
             print(f"Collection {self.collection_name} created successfully")
             
@@ -131,6 +213,35 @@ class MilvusManager:
             print(f"Error creating collection: {e}")
             raise
     
+    def create_index(self, num_vectors: Optional[int] = None):
+        """
+        Build the vector index on the embedding field.
+        
+        Args:
+            num_vectors: Number of vectors in the collection, used to size
+                nlist for IVF indexes; DEFAULT_NLIST is used when it is not known
+        """
+        if not self.collection:
+            raise ValueError("Collection not initialized")
+        
+        if self.index_type == "HNSW":
+            params = {"M": self.M, "efConstruction": self.ef_construction}
+        else:
+            self.nlist = choose_nlist(num_vectors) if num_vectors else DEFAULT_NLIST
+            params = {"nlist": self.nlist}
+        
+        print(f"Creating {self.index_type} index for embedding field ({params})...")
+        index_params = {
+            "metric_type": "IP",
+            "index_type": self.index_type,
+            "params": params
+        }
+        
+        self.collection.create_index(
+            field_name="embedding",
+            index_params=index_params
+        )
+    
     def load_collection(self):
         """Load the collection into memory."""
         if self.collection is None:
@@ -141,37 +252,124 @@ class MilvusManager:
     
     def insert_data(self, data: List[Dict[str, Any]]):
         """
-        Insert data into the collection.
+        Insert data into the collection, without flushing.
         
         Args:
             data: List of dictionaries containing vector data
         """
+        self.insert_data_stream(data)
+    
+    def insert_data_stream(self, items: Iterable[Dict[str, Any]], batch_size: int = INSERT_BATCH_SIZE) -> int:
+        """
+        Insert vector data from an iterable in fixed-size batches.
+        
+        Args:
+            items: Iterable of dictionaries containing vector data
+            batch_size: Number of vectors per insert request
+            
+        Returns:
+            Number of vectors inserted
+        """
+        items = iter(items)
+        
+        def batches():
+            while batch := list(islice(items, batch_size)):
+                yield (
+                    [item['id'] for item in batch],
+                    [item['values'] for item in batch],
+                    [item['metadata'] for item in batch]
+                )
+        
+        return self.insert_batches(batches())
+    
+    def insert_batches(self, batches: Iterable[Tuple[List[str], Any, List[Dict[str, Any]]]],
+                       max_workers: int = 4) -> int:
+        """
+        Insert column batches concurrently, without flushing.
+        
+        Batches are spread round-robin across the manager's connections. At
+        most two batches per worker are in flight, so memory stays bounded
+        when the batches are read lazily from a file. Call flush_and_compact()
+        once after the last insert.
+        
+        Args:
+            batches: Iterable of (ids, embeddings, metadata) batches
+            max_workers: Number of concurrent insert requests
+            
+        Returns:
+            Number of vectors inserted
+        """
+        if not self.collection:
+            raise ValueError("Collection not initialized")
+        
+        collections = [self.collection] + [Collection(self.collection_name, using=alias) for alias in self.aliases[1:]]
+        
+        inserted = 0
+        pending = set()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for n, (ids, embeddings, metadata) in enumerate(batches):
+                if len(pending) >= max_workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    inserted += sum(future.result() for future in done)
+                collection = collections[n % len(collections)]
+                pending.add(executor.submit(self.insert_batch, ids, embeddings, metadata, collection))
+            
+            inserted += sum(future.result() for future in pending)
+        
+        return inserted
+    
+    def flush_and_compact(self):
+        """Seal all inserted data, then merge the small segments a bulk insert leaves behind."""
+        if not self.collection:
+            raise ValueError("Collection not initialized")
+        
+        self.collection.flush()
+        print("Data flushed to disk")
+        
+        self.collection.compact()
+        self.collection.wait_for_compaction_completed()
+        print("Segments compacted")
+    
+    def insert_batch(self, ids: List[str], embeddings, metadata: List[Dict[str, Any]],
+                     collection: Optional[Collection] = None) -> int:
+        """
+        Insert one batch of vectors given as columns, without flushing.
+        
+        Chunk texts are uploaded to the text store first and only their
+        keys are stored in Milvus.
+        
+        Args:
+            ids: Vector IDs
+            embeddings: Vectors, as a float32 array of shape (n, dim) or a list of lists;
+                they are stored as float16
+            metadata: Metadata dictionaries aligned with ids
+            collection: Handle of the collection bound to the connection to
+                insert through; the default connection is used when omitted
+            
+        Returns:
+            Number of vectors inserted
+        """
         if not self.collection:
             raise ValueError("Collection not initialized")
         
-        print(f"Inserting {len(data)} vectors into Milvus...")
-        
-        ids = []
-        embeddings = []
-        texts = []
-        titles = []
-        sources = []
-        chunk_indices = []
-        total_chunks = []
-        
-        for item in data:
-            ids.append(item['id'])
-            embeddings.append(item['values'])
-            texts.append(item['metadata'].get('text', ''))
-            titles.append(item['metadata'].get('title', ''))
-            sources.append(item['metadata'].get('source', ''))
-            chunk_indices.append(int(item['metadata'].get('chunk_index', 0)))
-            total_chunks.append(int(item['metadata'].get('total_chunks', 1)))
+        collection = collection or self.collection
+        print(f"Inserting {len(ids)} vectors into Milvus...")
+        
+        embeddings = list(normalize_rows(embeddings).astype(np.float16))
+        text_keys = [text_store.text_key(i) for i in ids]
+        text_store.put_texts(text_keys, [m.get('text', '') for m in metadata])
+        titles = [m.get('title', '') for m in metadata]
+        sources = [m.get('source', '') for m in metadata]
+        chunk_indices = np.fromiter((as_int(m.get('chunk_index', 0)) for m in metadata), dtype=np.int64, count=len(metadata))
+        total_chunks = np.fromiter((as_int(m.get('total_chunks', 1)) for m in metadata), dtype=np.int64, count=len(metadata))
+        
+        pks = np.fromiter((hash_id(i) for i in ids), dtype=np.int64, count=len(ids))
         
         insert_data = [
+            pks,
             ids,
             embeddings,
-            texts,
+            text_keys,
             titles,
             sources,
             chunk_indices,
@@ -179,56 +377,84 @@ class MilvusManager:
         ]
         
         try:
-            mr = self.collection.insert(insert_data)
+            mr = collection.insert(insert_data)
             print(f"Insert completed. Insert count: {mr.insert_count}")
             print(f"Primary keys: {mr.primary_keys[:5]}...")
-            
-            self.collection.flush()
-            print("Data flushed to disk")
+            return mr.insert_count
             
         except Exception as e:
             print(f"Error inserting data: {e}")
             raise
     
-    def search(self, query_vector: List[float], top_k: int = 5) -> List[Dict[str, Any]]:
+    def search(self, query_vector: List[float], top_k: int = 5, nprobe: Optional[int] = None) -> List[Dict[str, Any]]:
         """
-        Search for similar vectors.
+        Search for vectors similar to a single query.
         
         Args:
             query_vector: Query embedding vector
             top_k: Number of top results to return
+            nprobe: Number of IVF clusters to scan, sqrt(nlist) by default;
+                ignored for HNSW indexes
             
         Returns:
             List of search results
         """
+        return self.search_batch([query_vector], top_k=top_k, nprobe=nprobe)[0]
+    
+    def search_batch(self, query_vectors, top_k: int = 5, nprobe: Optional[int] = None) -> List[List[Dict[str, Any]]]:
+        """
+        Search for vectors similar to several queries in one request.
+        
+        Args:
+            query_vectors: Query embedding vectors, as an array of shape
+                (n, dim) or a list of lists
+            top_k: Number of top results to return per query
+            nprobe: Number of IVF clusters to scan, sqrt(nlist) by default;
+                ignored for HNSW indexes
+            
+        Returns:
+            List of search results for each query, in query order
+        """
         if not self.collection:
             raise ValueError("Collection not initialized")
         
+        if self.index_type == "HNSW":
+            params = {"ef": max(self.ef, top_k)}
+        else:
+            if nprobe is None:
+                nprobe = max(1, int(round(math.sqrt(self.nlist))))
+            params = {"nprobe": nprobe}
+        print(f"Searching with {params}")
+        
         search_params = {
-            "metric_type": "COSINE",
-            "params": {"nprobe": 10}
+            "metric_type": "IP",
+            "params": params
         }
         
         results = self.collection.search(
-            data=[query_vector],
+            data=list(normalize_rows(query_vectors).astype(np.float16)),
             anns_field="embedding",
             param=search_params,
             limit=top_k,
-            output_fields=["text", "title", "source", "chunk_index", "total_chunks"]
+            output_fields=["orig_id", "text_key", "title", "source", "chunk_index", "total_chunks"]
         )
         
+        texts = iter(text_store.get_texts([hit.entity.get('text_key') for hits in results for hit in hits]))
+        
         formatted_results = []
-        for hit in results[0]:
-            result = {
-                'id': hit.id,
-                'score': hit.score,
-                'text': hit.entity.get('text'),
-                'title': hit.entity.get('title'),
-                'source': hit.entity.get('source'),
-                'chunk_index': hit.entity.get('chunk_index'),
-                'total_chunks': hit.entity.get('total_chunks')
-            }
-            formatted_results.append(result)
+        for hits in results:
+            query_results = []
+            for hit in hits:
+                query_results.append({
+                    'id': hit.entity.get('orig_id'),
+                    'score': hit.score,
+                    'text': next(texts),
+                    'title': hit.entity.get('title'),
+                    'source': hit.entity.get('source'),
+                    'chunk_index': hit.entity.get('chunk_index'),
+                    'total_chunks': hit.entity.get('total_chunks')
+                })
+            formatted_results.append(query_results)
         
         return formatted_results
     
@@ -242,10 +468,11 @@ class MilvusManager:
     
     def disconnect(self):
         """Disconnect from Milvus."""
-        connections.disconnect("default")
+        for alias in self.aliases:
+            connections.disconnect(alias)
         print("Disconnected from Milvus")
 
-def migrate_from_pinecone(export_file: str = "pinecone_export.json"):
+def migrate_from_pinecone(export_file: str = "pinecone_export.parquet"):
     """
     Migrate data from Pinecone export file to Milvus.
     
@@ -255,33 +482,35 @@ def migrate_from_pinecone(export_file: str = "pinecone_export.json"):
     print("Starting migration from Pinecone to Milvus...")
     print("=" * 60)
     
-    print(f"Loading data from {export_file}")
-    if export_file.endswith('.pkl'):
-        with open(export_file, 'rb') as f:
-            data = pickle.load(f)
-    else:
-        with open(export_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-    
-    print(f"Loaded {len(data)} vectors from export file")
-    
     milvus_manager = MilvusManager()
     
     try:
         milvus_manager.connect()
         
-        milvus_manager.create_collection(drop_existing=True)
+        milvus_manager.create_collection(drop_existing=True, defer_index=True)
         
-        milvus_manager.load_collection()
+        text_store.ensure_bucket()
+        
+        print(f"Loading data from {export_file}")
+        batches = iter_exported_batches(export_file, batch_size=INSERT_BATCH_SIZE)
+        first_batch = next(batches, None)
+        test_vector = None
+        inserted = 0
+        if first_batch is not None:
+            test_vector = first_batch[1][0]
+            inserted = milvus_manager.insert_batches(chain([first_batch], batches))
         
-        milvus_manager.insert_data(data)
+        milvus_manager.flush_and_compact()
+        
+        milvus_manager.create_index(num_vectors=inserted)
+        
+        milvus_manager.load_collection()
         
         stats = milvus_manager.get_collection_stats()
         print(f"Migration completed! Total vectors in Milvus: {stats['total_vectors']}")
         
         print("\nTesting search functionality...")
-        if data:
-            test_vector = data[0]['values']
+        if test_vector is not None:
             results = milvus_manager.search(test_vector, top_k=3)
             print(f"Search test returned {len(results)} results")
             for i, result in enumerate(results):
@@ -297,9 +526,10 @@ if __name__ == "__main__":
     print("Milvus Migration Tool")
     print("=" * 50)
     
-    export_file = "pinecone_export.json"
-    if not os.path.exists(export_file):
-        print(f"Export file {export_file} not found.")
+    export_files = ["pinecone_export.parquet", "pinecone_export.jsonl", "pinecone_export.json"]
+    export_file = next((f for f in export_files if os.path.exists(f)), None)
+    if export_file is None:
+        print(f"Export file {export_files[0]} not found.")
         print("Please run export_pinecone_data.py first to export data from Pinecone.")
         exit(1)
     
@@ -0,0 +1,47 @@
+import numpy as np
+from numba import njit, prange
+
+@njit(parallel=True, fastmath=True, cache=True)
+def _dot_rows(mat, q):
+    """Dot product of every row of mat with q."""
+    scores = np.empty(mat.shape[0], dtype=np.float32)
+    for i in prange(mat.shape[0]):
+        acc = np.float32(0.0)
+        for j in range(mat.shape[1]):
+            acc += mat[i, j] * q[j]
+        scores[i] = acc
+    return scores
+
+@njit(cache=True)
+def topk_cosine(mat, q, k):
+    """
+    Find the k rows of mat most similar to q.
+
+    Rows of mat and q must be L2-normalized, so the dot product is the
+    cosine similarity.
+
+    Args:
+        mat: Contiguous float32 matrix of shape (n, dim)
+        q: Contiguous float32 vector of shape (dim,)
+        k: Number of results
+
+    Returns:
+        Tuple of (indices, scores), best first
+    """
+    scores = _dot_rows(mat, q)
+    k = min(k, scores.shape[0])
+    best_idx = np.full(k, -1, dtype=np.int64)
+    best = np.full(k, -np.inf, dtype=np.float32)
+
+    for i in range(scores.shape[0]):
+        s = scores[i]
+        if k > 0 and s > best[k - 1]:
+            j = k - 1
+            while j > 0 and best[j - 1] < s:
+                best[j] = best[j - 1]
+                best_idx[j] = best_idx[j - 1]
+                j -= 1
+            best[j] = s
+            best_idx[j] = i
+
+    return best_idx, best
@@ -0,0 +1,75 @@
+import functools
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+TEXT_STORE_ENDPOINT = os.getenv("TEXT_STORE_ENDPOINT", "http://localhost:9000")
+TEXT_STORE_BUCKET = os.getenv("TEXT_STORE_BUCKET", "rag-chunks")
+TEXT_STORE_ACCESS_KEY = os.getenv("TEXT_STORE_ACCESS_KEY", "minioadmin")
+TEXT_STORE_SECRET_KEY = os.getenv("TEXT_STORE_SECRET_KEY", "minioadmin")
+
+executor = ThreadPoolExecutor(max_workers=16)
+
+@functools.lru_cache(maxsize=1)
+def get_client():
+    """
+    Create the S3 client for the chunk text bucket once per process.
+
+    Defaults to the MinIO instance started by docker-compose; set
+    TEXT_STORE_ENDPOINT to an empty string to use AWS S3.
+    """
+    return boto3.client(
+        "s3",
+        endpoint_url=TEXT_STORE_ENDPOINT or None,
+        aws_access_key_id=TEXT_STORE_ACCESS_KEY,
+        aws_secret_access_key=TEXT_STORE_SECRET_KEY,
+        config=Config(max_pool_connections=50, retries={"max_attempts": 3, "mode": "adaptive"})
+    )
+
+def text_key(vector_id: str) -> str:
+    """Return the object key holding the text of a vector."""
+    return f"chunks/{hashlib.sha256(vector_id.encode('utf-8')).hexdigest()}.txt"
+
+def ensure_bucket():
+    """Create the chunk text bucket if it doesn't exist yet."""
+    client = get_client()
+    try:
+        client.head_bucket(Bucket=TEXT_STORE_BUCKET)
+    except ClientError:
+        client.create_bucket(Bucket=TEXT_STORE_BUCKET)
+
+def put_texts(keys: List[str], texts: List[str]):
+    """
+    Upload texts to the chunk text bucket concurrently.
+
+    Args:
+        keys: Object keys
+        texts: Texts aligned with keys
+    """
+    client = get_client()
+    list(executor.map(
+        lambda key, text: client.put_object(Bucket=TEXT_STORE_BUCKET, Key=key, Body=text.encode("utf-8")),
+        keys,
+        texts
+    ))
+
+def get_texts(keys: List[str]) -> List[str]:
+    """
+    Download texts from the chunk text bucket concurrently.
+
+    Args:
+        keys: Object keys
+
+    Returns:
+        Texts aligned with keys
+    """
+    client = get_client()
+    return list(executor.map(
+        lambda key: client.get_object(Bucket=TEXT_STORE_BUCKET, Key=key)["Body"].read().decode("utf-8"),
+        keys
+    ))
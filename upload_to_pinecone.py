@@ -1,90 +1,166 @@
 import os
 import json
 import uuid
-from typing import List, Dict
+from collections import deque
+from itertools import islice
+from typing import List, Dict, Iterator, Tuple
+import numpy as np
 from dotenv import load_dotenv
 from pinecone import Pinecone
-from sentence_transformers import SentenceTransformer
+from cache import EmbeddingCache
+from embedding import MODEL_NAME, encode
 
 load_dotenv()
 
-pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
-index = pc.Index("nimonik-rag")
+PINECONE_POOL_THREADS = 32
+EMBED_BATCH_SIZE = 1024
+UPSERT_BATCH_SIZE = 100
 
-embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"), pool_threads=PINECONE_POOL_THREADS)
+index = pc.Index("nimonik-rag", pool_threads=PINECONE_POOL_THREADS)
+
+upload_cache = EmbeddingCache(dtype=np.float16)
 
 def chunk_text(text: str, chunk_size: int = 1000, overlap: int = 200) -> List[str]:
     if len(text) <= chunk_size:
         return [text]
     
+    # Find every '.' and newline once; UTF-32 keeps array positions equal to
+    # string indices, so each window's last break is a binary search.
+    code_points = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+    breaks = np.flatnonzero((code_points == ord('.')) | (code_points == ord('\n')))
+    
     chunks = []
     start = 0
     
     while start < len(text):
         end = start + chunk_size
-        chunk = text[start:end]
         
         if end < len(text):
-            last_period = chunk.rfind('.')
-            last_newline = chunk.rfind('\n')
-            break_point = max(last_period, last_newline)
+            idx = np.searchsorted(breaks, end) - 1
+            break_point = int(breaks[idx]) - start if idx >= 0 and breaks[idx] >= start else -1
             
             if break_point > start + chunk_size // 2:
-                chunk = chunk[:break_point + 1]
                 end = start + break_point + 1
         
-        chunks.append(chunk.strip())
+        chunks.append(text[start:end].strip())
         start = end - overlap
     
     return chunks
 
-def upload_documents(documents: List[Dict[str, str]]):
-    vectors_to_upload = []
-    
-    for doc in documents:
-        chunks = chunk_text(doc['text'])
+def iter_chunks_from_file(file_path: str, chunk_size: int = 1000, overlap: int = 200,
+                          read_size: int = 1 << 20) -> Iterator[str]:
+    """Yield the same chunks as chunk_text() for a file, holding only a sliding window of it in memory."""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        buffer = f.read(chunk_size + 1)
+        if len(buffer) <= chunk_size:
+            yield buffer
+            return
         
-        for i, chunk in enumerate(chunks):
-            print(f"Generating embedding for chunk {i+1}/{len(chunks)} of document: {doc.get('title', 'Untitled')}")
-            embedding = embedding_model.encode(chunk).tolist()
+        offset = 0
+        start = 0
+        eof = False
+        
+        while True:
+            # Keep one character past the window so we know whether text follows it
+            while not eof and offset + len(buffer) <= start + chunk_size:
+                data = f.read(read_size)
+                if data:
+                    buffer += data
+                else:
+                    eof = True
             
-            vector_id = f"{doc.get('id', str(uuid.uuid4()))}_chunk_{i}"
+            text_end = offset + len(buffer)
+            if start >= text_end:
+                break
             
+            end = start + chunk_size
+            
+            if end < text_end:
+                window = buffer[start - offset:end - offset]
+                break_point = max(window.rfind('.'), window.rfind('\n'))
+                
+                if break_point > start + chunk_size // 2:
+                    end = start + break_point + 1
+            
+            yield buffer[start - offset:end - offset].strip()
+            start = end - overlap
+            
+            if start - offset > read_size:
+                buffer = buffer[start - offset:]
+                offset = start
+
+def iter_document_chunks(documents: List[Dict[str, str]]) -> Iterator[Tuple[Dict[str, str], str, int, int, str]]:
+    """Yield (document, document ID, chunk index, total chunks, chunk) for every chunk of every document."""
+    for doc in documents:
+        doc_id = doc.get('id', str(uuid.uuid4()))
+        
+        if 'path' in doc:
+            total_chunks = sum(1 for _ in iter_chunks_from_file(doc['path']))
+            chunks = iter_chunks_from_file(doc['path'])
+        else:
+            chunks = chunk_text(doc['text'])
+            total_chunks = len(chunks)
+        
+        for i, chunk in enumerate(chunks):
+            yield doc, doc_id, i, total_chunks, chunk
+
+def wait_for_upsert(batch_number: int, count: int, async_result):
+    """Wait for one asynchronous upsert and report how it went."""
+    try:
+        async_result.get()
+        print(f"Successfully uploaded batch {batch_number} ({count} vectors)")
+    except Exception as e:
+        print(f"Error uploading batch {batch_number}: {e}")
+
+def upload_documents(documents: List[Dict[str, str]]):
+    chunked = iter_document_chunks(documents)
+    # At most two upserts per pool thread are queued, so the vectors held by
+    # pending requests stay bounded however many chunks are streamed
+    pending = deque()
+    batch_number = 0
+    uploaded = 0
+    
+    while batch := list(islice(chunked, EMBED_BATCH_SIZE)):
+        print(f"Generating embeddings for chunks {uploaded + 1}-{uploaded + len(batch)}")
+        embeddings = encode([chunk for *_, chunk in batch], cache=upload_cache)
+        
+        vectors_to_upload = []
+        
+        for (doc, doc_id, i, total_chunks, chunk), embedding in zip(batch, embeddings):
             metadata = {
                 'text': chunk,
                 'title': doc.get('title', 'Untitled'),
                 'source': doc.get('source', 'Unknown'),
                 'chunk_index': i,
-                'total_chunks': len(chunks)
+                'total_chunks': total_chunks
             }
             
             if 'metadata' in doc:
                 metadata.update(doc['metadata'])
             
             vectors_to_upload.append({
-                'id': vector_id,
-                'values': embedding,
+                'id': f"{doc_id}_chunk_{i}",
+                'values': embedding.tolist(),
                 'metadata': metadata
             })
-    
-    batch_size = 100
-    for i in range(0, len(vectors_to_upload), batch_size):
-        batch = vectors_to_upload[i:i + batch_size]
-        print(f"Uploading batch {i//batch_size + 1}/{(len(vectors_to_upload) + batch_size - 1)//batch_size}")
         
-        try:
-            index.upsert(vectors=batch)
-            print(f"Successfully uploaded {len(batch)} vectors")
-        except Exception as e:
-            print(f"Error uploading batch: {e}")
+        for i in range(0, len(vectors_to_upload), UPSERT_BATCH_SIZE):
+            if len(pending) >= PINECONE_POOL_THREADS * 2:
+                wait_for_upsert(*pending.popleft())
+            upsert_batch = vectors_to_upload[i:i + UPSERT_BATCH_SIZE]
+            batch_number += 1
+            pending.append((batch_number, len(upsert_batch), index.upsert(vectors=upsert_batch, async_req=True)))
+        
+        uploaded += len(batch)
+    
+    while pending:
+        wait_for_upsert(*pending.popleft())
     
-    print(f"Upload complete! Total vectors uploaded: {len(vectors_to_upload)}")
+    print(f"Upload complete! Total vectors uploaded: {uploaded}")
 
 def upload_from_file(file_path: str, title: str = None, source: str = None):
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            text = f.read()
-        
         if not title:
             title = os.path.basename(file_path)
         
@@ -95,7 +171,7 @@ def upload_from_file(file_path: str, title: str = None, source: str = None):
             'id': str(uuid.uuid4()),
             'title': title,
             'source': source,
-            'text': text
+            'path': file_path
         }
         
         upload_documents([document])
@@ -168,6 +244,6 @@ sample_documents = [
 
 if __name__ == "__main__":
     print("Uploading sample documents to Pinecone...")
-    print(f"Using embedding model: all-MiniLM-L6-v2")
+    print(f"Using embedding model: {MODEL_NAME}")
     print(f"Index: nimonik-rag")
     upload_documents(sample_documents)
\ No newline at end of file